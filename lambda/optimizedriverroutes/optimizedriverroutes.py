@@ -1,43 +1,183 @@
 import json
 import os
+import re
 import time
-import urllib.request
+import threading
 import urllib.parse
 import io
+import gzip
 import csv
 import boto3
+from boto3.dynamodb.conditions import Key
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Initialize AWS Services
-dynamodb = boto3.resource('dynamodb')
+# orjson parses the Google API responses several times faster; fall back to stdlib json
+try:
+    import orjson
+    json_loads = orjson.loads
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+except ImportError:
+    json_loads = json.loads
+    json_dumps = json.dumps
+
+# Initialize AWS Services (pooled keep-alive connections, adaptive retries)
+boto_config = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    retries={'mode': 'adaptive', 'max_attempts': 5}
+)
+dynamodb = boto3.resource('dynamodb', config=boto_config)
 table = dynamodb.Table('DeliveryManagement')
-s3 = boto3.client('s3')
+s3 = boto3.client('s3', config=boto_config)
 BUCKET_NAME = 'delivery-manifest-bucket'
+PROCESSED_DATE_INDEX = 'ProcessedDate-DriverID-index'  # GSI: ProcessedDate (hash) + DriverID (range)
+
+# Route CSVs above 8 MB are uploaded as concurrent 16 MB multipart parts
+CSV_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=8
+)
+
+# Open the DynamoDB connection during init so the first invocation doesn't pay for it
+try:
+    table.meta.client.describe_table(TableName=table.name)
+except Exception as e:
+    print(f"⚠ Failed to warm up DynamoDB connection: {str(e)}")
+
+# Verbose per-stop logging (the full route is always in the exported CSV)
+DEBUG = os.environ.get('DEBUG', '').strip().lower() in ('1', 'true', 'yes', 'on')
 
 # Fixed start location
 START_LOCATION = "1-3 Britannia Way, London NW10 7PR"
 
 # Constants for optimization
-MAX_STOPS_PER_REQUEST = 25  # Google API limit for waypoints
+SAVINGS_ALGORITHM_MIN_STOPS = 26  # Longer routes start from Clarke-Wright instead of nearest neighbor
+EARTH_RADIUS_M = 6371000
 TRAFFIC_MODEL = "best_guess"  # Options: "best_guess", "pessimistic", "optimistic"
 OPTIMIZATION_ATTEMPTS = 3     # Try multiple optimization runs and select the best
+DRIVER_MAX_WORKERS = 8        # Drivers optimized concurrently
+TWO_OPT_MAX_ITERATIONS = 1000 # Upper bound on 2-opt improvement passes
+
+# Fallback timing estimates (minutes) when real leg durations are unavailable
+DEPOT_TO_FIRST_MINUTES = 20  # From depot to first stop
+BETWEEN_STOPS_MINUTES = 8    # Between stops (varies by urban/rural)
+SERVICE_MINUTES = 5          # Time spent at each stop
+
+# HTTP settings for Google API calls
+HTTP_TIMEOUT = 10  # seconds
+HTTP_RETRY = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+
+# One keep-alive session per thread (Session is not safe to share across threads)
+_thread_local = threading.local()
+
+def get_http_session():
+    """Return this thread's pooled HTTP session so TLS connections are reused"""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=HTTP_RETRY))
+        _thread_local.session = session
+    return session
+
+# Geocoding concurrency (Google allows 50 QPS for the Geocoding API)
+GEOCODE_MAX_WORKERS = 20
+GEOCODE_MAX_QPS = 50
+
+# Kept across warm invocations so each worker thread keeps its keep-alive session
+geocode_executor = ThreadPoolExecutor(max_workers=GEOCODE_MAX_WORKERS)
+
+_rate_lock = threading.Lock()
+_next_geocode_slot = 0.0
+
+def wait_for_geocode_slot():
+    """Block until the next request fits under GEOCODE_MAX_QPS across all threads"""
+    global _next_geocode_slot
+    with _rate_lock:
+        now = time.monotonic()
+        slot = max(now, _next_geocode_slot)
+        _next_geocode_slot = slot + 1.0 / GEOCODE_MAX_QPS
+    if slot > now:
+        time.sleep(slot - now)
+
+# UK postcode with spaces removed; matches are rewritten as "OUTWARD INWARD"
+POSTCODE_RE = re.compile(r"[A-Z]{1,2}\d[A-Z\d]?\d[A-Z]{2}")
+
+def normalize_address(address):
+    """Normalize an address/postcode so repeats share one geocoding call and cache entry"""
+    compact = "".join(address.split()).upper()
+    if POSTCODE_RE.fullmatch(compact):
+        return f"{compact[:-3]} {compact[-3:]}"
+    return " ".join(address.split()).upper()
+
+# Geocoding results persisted across runs (postcodes recur day to day)
+GEOCODE_CACHE_KEY = "cache/geocode.json"
+
+def load_geocode_cache():
+    """Load the persisted address -> (lng, lat) cache from S3"""
+    try:
+        obj = s3.get_object(Bucket=BUCKET_NAME, Key=GEOCODE_CACHE_KEY)
+        cache = json_loads(obj["Body"].read())
+        print(f"Loaded {len(cache)} cached geocoding results")
+        return {address: tuple(coords) for address, coords in cache.items()}
+    except s3.exceptions.NoSuchKey:
+        return {}
+    except Exception as e:
+        print(f"⚠️ Failed to load geocoding cache: {str(e)}")
+        return {}
+
+def save_geocode_cache():
+    """Write the geocoding cache back to S3 if new addresses were resolved"""
+    global _geocode_cache_dirty
+    if not _geocode_cache_dirty:
+        return
+    
+    try:
+        s3.put_object(
+            Bucket=BUCKET_NAME,
+            Key=GEOCODE_CACHE_KEY,
+            Body=json_dumps(_geocode_cache),
+            ContentType='application/json'
+        )
+        _geocode_cache_dirty = False
+        print(f"✅ Saved {len(_geocode_cache)} geocoding results to cache")
+    except Exception as e:
+        print(f"⚠️ Failed to save geocoding cache: {str(e)}")
+
+# Loaded once per cold start and reused by warm invocations
+_geocode_cache = load_geocode_cache()
+_geocode_cache_dirty = False
 
 def get_coordinates(address, api_key):
     """Enhanced geocoding with better error handling and caching"""
+    global _geocode_cache_dirty
+    if address in _geocode_cache:
+        return _geocode_cache[address]
+    
+    wait_for_geocode_slot()
     encoded_address = urllib.parse.quote(address)
     url = f"https://maps.googleapis.com/maps/api/geocode/json?address={encoded_address}&key={api_key}"
     
     try:
-        with urllib.request.urlopen(url) as response:
-            data = json.loads(response.read().decode())
+        data = json_loads(get_http_session().get(url, timeout=HTTP_TIMEOUT).content)
             
         if data["status"] == "OK" and data["results"]:
             location = data["results"][0]["geometry"]["location"]
             formatted_address = data["results"][0]["formatted_address"]
             print(f"Found location: {formatted_address}")
-            return (location["lng"], location["lat"])
+            coords = (location["lng"], location["lat"])
+            _geocode_cache[address] = coords
+            _geocode_cache_dirty = True
+            return coords
         
         if data["status"] == "ZERO_RESULTS":
             print(f"⚠️ No geocoding results for address: {address}")
@@ -52,69 +192,86 @@ def get_coordinates(address, api_key):
         print(f"Error geocoding: {str(e)}")
         return None
 
-def calculate_distance_matrix(locations, api_key):
-    """Calculate distance matrix between all locations using Distance Matrix API"""
-    print("Calculating distance matrix...")
-    
+# Leg durations are read off the diagonal of small Distance Matrix blocks: origins are
+# stops k..k+9 and destinations stops k+1..k+10, so one 10 x 10 request (the API's
+# 100-element limit) covers 10 consecutive legs
+DISTANCE_MATRIX_LEGS_PER_REQUEST = 10
+
+# One pool is shared by all drivers and kept across warm invocations,
+# so each worker thread keeps its keep-alive session
+DISTANCE_MATRIX_MAX_WORKERS = 20
+leg_executor = ThreadPoolExecutor(max_workers=DISTANCE_MATRIX_MAX_WORKERS)
+
+def request_distance_matrix(origins, destinations, api_key):
+    """
+    Make a single Distance Matrix API request between "lat,lng" origin and destination strings.
+    Returns (distance_matrix, duration_matrix) of shape (len(origins), len(destinations)), or (None, None).
+    """
     # Use the standard Distance Matrix API endpoint
     base_url = "https://maps.googleapis.com/maps/api/distancematrix/json"
     
-    # Format origins and destinations as lat,lng strings
-    coord_strings = []
-    for coords in locations:
-        # Format as "lat,lng" string (note the order is reversed from our internal format)
-        coord_strings.append(f"{coords[1]},{coords[0]}")
-    
-    # Join coordinates with pipe character
-    locations_str = "|".join(coord_strings)
-    
-    # Build the API request URL
-    url = f"{base_url}?origins={locations_str}&destinations={locations_str}&mode=driving&key={api_key}"
+    # Build the API request URL (coordinates joined with pipe character)
+    url = f"{base_url}?origins={'|'.join(origins)}&destinations={'|'.join(destinations)}&mode=driving&key={api_key}"
     
     # Add traffic information if needed
     if TRAFFIC_MODEL:
         url += f"&departure_time=now&traffic_model={TRAFFIC_MODEL}"
     
     try:
-        print(f"Making request to Distance Matrix API...")
-        with urllib.request.urlopen(url) as response:
-            data = json.loads(response.read().decode())
+        data = json_loads(get_http_session().get(url, timeout=HTTP_TIMEOUT).content)
         
         # Check if the request was successful
-        if data.get("status") == "OK":
-            print(f"✅ Successfully retrieved distance matrix")
-            
-            # Process the response into a distance matrix
-            matrix_size = len(locations)
-            distance_matrix = np.zeros((matrix_size, matrix_size))
-            duration_matrix = np.zeros((matrix_size, matrix_size))
-            
-            for i, row in enumerate(data.get("rows", [])):
-                for j, element in enumerate(row.get("elements", [])):
-                    if element.get("status") == "OK":
-                        # Get distance in meters
-                        distance = element.get("distance", {}).get("value", 0)
-                        # Get duration in seconds
-                        duration = element.get("duration", {}).get("value", 0)
-                        
-                        # Use duration_in_traffic if available
-                        if "duration_in_traffic" in element:
-                            duration = element.get("duration_in_traffic", {}).get("value", duration)
-                        
-                        distance_matrix[i][j] = distance
-                        duration_matrix[i][j] = duration
-            
-            print(f"✅ Successfully calculated distance matrix for {matrix_size} locations")
-            return distance_matrix, duration_matrix
-        else:
+        if data.get("status") != "OK":
             print(f"⚠️ Distance Matrix API error: {data.get('status')}")
             if "error_message" in data:
                 print(f"Error details: {data.get('error_message')}")
             return None, None
+        
+        # Process the response into flat lists, then build each block in one conversion
+        distances = []
+        durations = []
+        for row in data.get("rows", []):
+            for element in row.get("elements", []):
+                if element.get("status") == "OK":
+                    # Distance in meters; duration in seconds (duration_in_traffic if available)
+                    distances.append(element["distance"]["value"])
+                    durations.append(element.get("duration_in_traffic", element["duration"])["value"])
+                else:
+                    distances.append(0)
+                    durations.append(0)
+        
+        shape = (len(origins), len(destinations))
+        distance_matrix = np.asarray(distances, dtype=np.float64).reshape(shape)
+        duration_matrix = np.asarray(durations, dtype=np.float64).reshape(shape)
+        
+        return distance_matrix, duration_matrix
     except Exception as e:
-        print(f"Error calculating distance matrix: {str(e)}")
+        print(f"Error calling Distance Matrix API: {str(e)}")
         return None, None
 
+def calculate_leg_durations(ordered_coords, api_key):
+    """
+    Drive time in seconds for each consecutive leg of an ordered route (depot first).
+    Legs are fetched DISTANCE_MATRIX_LEGS_PER_REQUEST at a time, with the blocks
+    requested concurrently. Returns a NumPy array, or None on failure.
+    """
+    # Format as "lat,lng" strings (note the order is reversed from our internal format)
+    coord_strings = [f"{coords[1]},{coords[0]}" for coords in ordered_coords]
+    num_legs = len(coord_strings) - 1
+    block_starts = range(0, num_legs, DISTANCE_MATRIX_LEGS_PER_REQUEST)
+    print(f"Making {len(block_starts)} request(s) to Distance Matrix API for {num_legs} route legs...")
+    
+    def fetch_block(start):
+        end = min(start + DISTANCE_MATRIX_LEGS_PER_REQUEST, num_legs)
+        _, block = request_distance_matrix(coord_strings[start:end], coord_strings[start + 1:end + 1], api_key)
+        return None if block is None else np.diagonal(block)  # Origin k -> destination k + 1
+    
+    blocks = list(leg_executor.map(fetch_block, block_starts))
+    if any(block is None for block in blocks):
+        return None
+    
+    return np.concatenate(blocks)
+
 def optimize_with_savings_algorithm(start_idx, distance_matrix, duration_matrix):
     """
     Implement Clarke-Wright savings algorithm for VRP (Vehicle Routing Problem)
@@ -122,72 +279,50 @@ def optimize_with_savings_algorithm(start_idx, distance_matrix, duration_matrix)
     """
     n = len(distance_matrix)
     if n <= 2:
-        return list(range(1, n))  # If only 1 or 2 points (besides depot), order doesn't matter
-    
-    # Calculate savings for each pair
-    savings = []
-    for i in range(1, n):  # Skip depot (index 0)
-        for j in range(i+1, n):  # Only consider each pair once
-            # Savings formula: d(0,i) + d(0,j) - d(i,j)
-            # We use duration matrix for time-based optimization
-            saving = (duration_matrix[start_idx][i] + duration_matrix[start_idx][j] 
-                     - duration_matrix[i][j])
-            savings.append((i, j, saving))
-    
-    # Sort savings in descending order
-    savings.sort(key=lambda x: x[2], reverse=True)
-    
-    # Initialize routes
-    routes = [[i] for i in range(1, n)]  # Each location in its own route
-    visited = [False] * n
-    visited[start_idx] = True  # Mark depot as visited
+        return list(range(n - 1))  # If only 1 or 2 points (besides depot), order doesn't matter
+    
+    # Savings formula: d(0,i) + d(0,j) - d(i,j), computed for every pair at once
+    # We use duration matrix for time-based optimization
+    D = np.asarray(duration_matrix, dtype=np.float64)
+    from_start = D[start_idx, 1:]  # Skip depot (index 0)
+    S = from_start[:, None] + from_start[None, :] - D[1:, 1:]
+    
+    # Only consider each pair once, sorted by savings in descending order
+    iu = np.triu_indices(n - 1, k=1)
+    order = np.argsort(-S[iu], kind='stable')
+    pairs = np.column_stack((iu[0][order] + 1, iu[1][order] + 1)).tolist()
+    
+    # Initialize routes; only route endpoints are indexed since merges happen at the ends
+    routes = {i: deque([i]) for i in range(1, n)}  # Each location in its own route
+    end_to_route = {i: i for i in range(1, n)}  # Endpoint location -> id of its route
     
     # Merge routes based on savings
-    for i, j, _ in savings:
-        route_i = None
-        route_j = None
+    for i, j in pairs:
+        route_i = end_to_route.get(i)
+        route_j = end_to_route.get(j)
         
-        # Find routes containing i and j
-        for idx, route in enumerate(routes):
-            if i in route:
-                route_i = idx
-            if j in route:
-                route_j = idx
-                
-        # Skip if i and j are already in same route
-        if route_i == route_j:
+        # Skip if i or j is interior to a route, or both are already in the same route
+        if route_i is None or route_j is None or route_i == route_j:
             continue
-            
-        # Check if i is at an end of its route
-        i_at_end = (routes[route_i][0] == i or routes[route_i][-1] == i)
-        # Check if j is at an end of its route
-        j_at_end = (routes[route_j][0] == j or routes[route_j][-1] == j)
         
-        if i_at_end and j_at_end:
-            # Merge the two routes
-            if routes[route_i][0] == i:
-                if routes[route_j][0] == j:
-                    # Reverse route_j and append route_i
-                    routes[route_j].reverse()
-                    routes[route_j].extend(routes[route_i])
-                else:
-                    # Append route_i to route_j
-                    routes[route_j].extend(routes[route_i])
-            else:
-                if routes[route_j][0] == j:
-                    # Append route_j to route_i
-                    routes[route_i].extend(routes[route_j])
-                else:
-                    # Reverse route_i and append route_j
-                    routes[route_i].reverse()
-                    routes[route_i].extend(routes[route_j])
-                    
-            # Remove the merged route
-            routes.pop(max(route_i, route_j))
+        # Splice route_j onto the end of route_i that holds i, entering route_j at j
+        merged = routes[route_i]
+        other = routes.pop(route_j)
+        from_j = other if other[0] == j else reversed(other)
+        if merged[-1] == i:
+            merged.extend(from_j)
+        else:
+            merged.extendleft(from_j)
+        
+        # i and j are now interior; re-index the merged route's endpoints
+        del end_to_route[i]
+        del end_to_route[j]
+        end_to_route[merged[0]] = route_i
+        end_to_route[merged[-1]] = route_i
             
     # Combine all routes (should be just one for TSP)
     final_route = []
-    for route in routes:
+    for route in routes.values():
         final_route.extend(route)
         
     # Adjust indices to account for skipping the depot (index 0)
@@ -195,138 +330,145 @@ def optimize_with_savings_algorithm(start_idx, distance_matrix, duration_matrix)
     
     return final_route
 
-def optimize_route_with_routes_api(start_coords, location_coords, api_key):
-    """Optimize route using Google Routes API with enhanced parameters"""
-    print("Optimizing route using Google Routes API...")
-    
-    # Calculate total number of locations including start point
-    total_locations = len(location_coords) + 1
-    
-    # For very large routes, we need to break them into chunks due to API limits
-    if total_locations > MAX_STOPS_PER_REQUEST + 1:
-        print(f"⚠️ Too many stops ({total_locations-1}), breaking into chunks.")
-        
-        # Calculate distance matrix for all locations
-        all_coords = [start_coords] + location_coords
-        distance_matrix, duration_matrix = calculate_distance_matrix(all_coords, api_key)
-        
-        if distance_matrix is None or duration_matrix is None:
-            print("⚠️ Failed to calculate distance matrix. Falling back to default order.")
-            return list(range(len(location_coords)))
-            
-        # Use savings algorithm for initial optimization
-        optimized_indices = optimize_with_savings_algorithm(0, distance_matrix, duration_matrix)
-        
-        # Then refine using Routes API in smaller chunks
-        chunk_size = MAX_STOPS_PER_REQUEST - 1  # Leave room for start/end
-        chunks = [optimized_indices[i:i+chunk_size] for i in range(0, len(optimized_indices), chunk_size)]
-        
-        refined_indices = []
-        for chunk in chunks:
-            chunk_coords = [location_coords[i] for i in chunk]
-            refined_chunk = optimize_chunk_with_routes_api(start_coords, chunk_coords, api_key)
-            refined_indices.extend([chunk[i] for i in refined_chunk])
-            
-        return refined_indices
-    
-    # Since external APIs are having issues, let's implement a simple nearest neighbor algorithm
-    print("Using nearest neighbor algorithm for route optimization...")
-    
-    # Start from the depot
-    current_point = start_coords
-    remaining_points = list(range(len(location_coords)))
+def nearest_neighbor_order(cost_matrix):
+    """
+    Greedy nearest neighbor ordering starting from the depot.
+    cost_matrix has the depot at index 0 and stop k at index k + 1; returns stop indices.
+    Visited stops are masked by setting their column to inf once, so each step is a
+    single row argmin with no temporary arrays.
+    """
+    remaining = np.array(cost_matrix, dtype=np.float64)[:, 1:]
     route = []
+    current = 0
     
     # Find nearest unvisited point until all points are visited
-    while remaining_points:
-        nearest_idx = -1
-        min_distance = float('inf')
+    for _ in range(remaining.shape[1]):
+        idx = int(remaining[current].argmin())
+        route.append(idx)
+        remaining[:, idx] = np.inf
+        current = idx + 1
+    
+    return route
+
+def haversine_matrix(points):
+    """Pairwise great-circle distances in meters between (lng, lat) points"""
+    points = np.radians(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+    lng = points[:, 0]
+    lat = points[:, 1]
+    dlat = lat[:, None] - lat[None, :]
+    dlng = lng[:, None] - lng[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def two_opt(route, cost_matrix):
+    """
+    Refine a one-way route with 2-opt (reverse a segment while it shortens the trip).
+    cost_matrix has the depot at index 0 and stop k at index k + 1; route holds stop indices.
+    Each pass scores every possible reversal at once with NumPy and applies the best one.
+    """
+    D = np.asarray(cost_matrix, dtype=np.float64)
+    tour = np.array([0] + [i + 1 for i in route])
+    m = len(tour)
+    if m < 4:
+        return list(route)
+    
+    for _ in range(TWO_OPT_MAX_ITERATIONS):
+        # Reversing tour[i..j] swaps edges (a,b) + (c,d) for (a,c) + (b,d),
+        # with a = tour[i-1], b = tour[i], c = tour[j], d = tour[j+1] (none if j is last)
+        a = tour[:-1]
+        b = tour[1:]
+        removed_ab = D[a, b]
+        removed_cd = np.append(D[tour[1:-1], tour[2:]], 0.0)
+        added_ac = D[a[:, None], b[None, :]]
+        added_bd = np.zeros((m - 1, m - 1))
+        added_bd[:, :-1] = D[b[:, None], tour[None, 2:]]
         
-        # Find the nearest point
-        for idx in remaining_points:
-            point = location_coords[idx]
-            # Simple Euclidean distance calculation
-            dist = ((current_point[0] - point[0]) ** 2 + (current_point[1] - point[1]) ** 2) ** 0.5
-            if dist < min_distance:
-                min_distance = dist
-                nearest_idx = idx
+        gain = removed_ab[:, None] + removed_cd[None, :] - added_ac - added_bd
+        gain[np.tril_indices(m - 1)] = 0.0  # Only segments with i < j
         
-        # Add nearest point to route and update current position
-        if nearest_idx != -1:
-            route.append(nearest_idx)
-            current_point = location_coords[nearest_idx]
-            remaining_points.remove(nearest_idx)
+        best = int(gain.argmax())
+        if gain.flat[best] <= 1e-9:
+            break
+        i, j = divmod(best, m - 1)
+        tour[i + 1:j + 2] = tour[i + 1:j + 2][::-1].copy()
     
-    print(f"✅ Optimized route using nearest neighbor algorithm")
-    return route
+    return [int(t) - 1 for t in tour[1:]]
 
-def optimize_chunk_with_routes_api(start_coords, chunk_coords, api_key):
-    """Optimize a chunk of the route using nearest neighbor algorithm"""
-    print("Using nearest neighbor for chunk optimization...")
+def optimize_route(start_coords, location_coords):
+    """
+    Order the stops for a one-way trip from start_coords.
+    Costs are great-circle distances computed locally, so no API calls are needed:
+    Clarke-Wright savings for long routes, nearest neighbor for short ones, then 2-opt.
+    """
+    cost_matrix = haversine_matrix(np.vstack((start_coords, location_coords)))
     
-    # Start from the depot
-    current_point = start_coords
-    remaining_points = list(range(len(chunk_coords)))
-    route = []
+    # One or two stops: visiting the closer one first is already optimal
+    if len(location_coords) <= 2:
+        return nearest_neighbor_order(cost_matrix)
     
-    # Find nearest unvisited point until all points are visited
-    while remaining_points:
-        nearest_idx = -1
-        min_distance = float('inf')
-        
-        # Find the nearest point
-        for idx in remaining_points:
-            point = chunk_coords[idx]
-            # Simple Euclidean distance calculation
-            dist = ((current_point[0] - point[0]) ** 2 + (current_point[1] - point[1]) ** 2) ** 0.5
-            if dist < min_distance:
-                min_distance = dist
-                nearest_idx = idx
-        
-        # Add nearest point to route and update current position
-        if nearest_idx != -1:
-            route.append(nearest_idx)
-            current_point = chunk_coords[nearest_idx]
-            remaining_points.remove(nearest_idx)
+    if len(location_coords) >= SAVINGS_ALGORITHM_MIN_STOPS:
+        print(f"Using savings algorithm for {len(location_coords)} stops...")
+        route = optimize_with_savings_algorithm(0, cost_matrix, cost_matrix)
+    else:
+        print("Using nearest neighbor algorithm for route optimization...")
+        route = nearest_neighbor_order(cost_matrix)
     
-    print(f"✅ Optimized chunk using nearest neighbor algorithm")
+    route = two_opt(route, cost_matrix)
+    print("✅ Optimized route with 2-opt refinement")
     return route
 
+def estimate_drive_minutes(leg_durations, num_stops):
+    """Drive time in minutes to reach each stop, from real leg durations when available"""
+    if leg_durations is None:
+        return [DEPOT_TO_FIRST_MINUTES] + [BETWEEN_STOPS_MINUTES] * (num_stops - 1)
+    return [int(round(seconds / 60)) for seconds in leg_durations]
+
+# RouteSequence updates run concurrently on one pool shared by all drivers
+SEQUENCE_UPDATE_MAX_WORKERS = 16
+sequence_executor = ThreadPoolExecutor(max_workers=SEQUENCE_UPDATE_MAX_WORKERS)
+
+def set_route_sequence(delivery, sequence):
+    """Set only the RouteSequence attribute of one delivery; returns True on success"""
+    try:
+        table.update_item(
+            Key={"PK": delivery["PK"], "SK": delivery["SK"]},
+            UpdateExpression="SET RouteSequence = :seq",
+            ExpressionAttributeValues={":seq": sequence}
+        )
+        return True
+    except Exception as e:
+        print(f"⚠ Failed to update sequence for delivery {delivery.get('PK', 'unknown')}: {str(e)}")
+        return False
+
 def update_route_sequence(driver_id, deliveries, optimized_sequence):
     """
     Update the RouteSequence attribute for each delivery in DynamoDB.
+    Items come from an eventually consistent GSI, so only RouteSequence is written
+    (one update_item each, issued concurrently) rather than putting the items back whole.
     """
-    success_count = 0
+    # Update the local delivery objects (also used for CSV export)
     for i, original_index in enumerate(optimized_sequence):
-        try:
-            delivery = deliveries[original_index]
-            delivery_id = delivery["PK"]
-            sk_value = delivery["SK"]
-            
-            # Update DynamoDB with the optimized sequence
-            table.update_item(
-                Key={"PK": delivery_id, "SK": sk_value},
-                UpdateExpression="SET RouteSequence = :seq",
-                ExpressionAttributeValues={":seq": i + 1}
-            )
-            success_count += 1
-            
-            # Update the local delivery object for CSV export
-            deliveries[original_index]["RouteSequence"] = i + 1
-            
-        except Exception as e:
-            print(f"⚠ Failed to update sequence for delivery at index {original_index}: {str(e)}")
+        deliveries[original_index]["RouteSequence"] = i + 1
+    
+    ordered = [deliveries[original_index] for original_index in optimized_sequence]
+    success_count = sum(sequence_executor.map(set_route_sequence, ordered, range(1, len(ordered) + 1)))
     
-    print(f"✅ Updated sequence for {success_count}/{len(optimized_sequence)} deliveries")
+    print(f"✅ Updated sequence for {success_count}/{len(optimized_sequence)} deliveries for {driver_id}")
     return success_count
 
-def export_driver_routes_to_csv(driver_id, deliveries):
+def export_driver_routes_to_csv(driver_id, route_stops, drive_minutes):
     """
     Generate a CSV file for each driver's optimized route and upload it to S3.
+    route_stops are the driver's deliveries already in optimized order, and
+    drive_minutes the driving time to reach each of them.
     """
-    csv_buffer = io.StringIO()
-    writer = csv.writer(csv_buffer)
+    # Encode and gzip rows straight into a bytes buffer so the upload doesn't need a second copy
+    csv_buffer = io.BytesIO()
+    csv_gzip = gzip.GzipFile(fileobj=csv_buffer, mode='wb', compresslevel=6)
+    csv_text = io.TextIOWrapper(csv_gzip, encoding='utf-8', newline='')
+    writer = csv.writer(csv_text)
     writer.writerow([
+        "DriverID",
         "RouteSequence", 
         "DeliveryID", 
         "Postcode", 
@@ -337,27 +479,13 @@ def export_driver_routes_to_csv(driver_id, deliveries):
         "EstimatedDuration"
     ])
     
-    # Sort deliveries by RouteSequence
-    sorted_deliveries = sorted(deliveries, key=lambda x: x.get("RouteSequence", 999))
-    
     # Calculate estimated arrival times based on real route timing
     start_time = 9 * 60  # 9:00 AM in minutes from midnight
     cumulative_time = 0
     
-    for idx, delivery in enumerate(sorted_deliveries):
-        if "RouteSequence" not in delivery:
-            continue
-            
-        # More realistic timing estimates
-        if idx == 0:
-            # First delivery from depot (typical driving time)
-            drive_time = 20  # minutes
-        else:
-            # Between stops (varies by urban/rural)
-            drive_time = 8  # minutes
-            
+    for delivery, drive_time in zip(route_stops, drive_minutes):
         # Time spent at location
-        service_time = 5  # minutes
+        service_time = SERVICE_MINUTES
         
         cumulative_time += drive_time
         arrival_minutes = start_time + cumulative_time
@@ -369,6 +497,7 @@ def export_driver_routes_to_csv(driver_id, deliveries):
         cumulative_time += service_time
         
         writer.writerow([
+            driver_id,
             delivery.get("RouteSequence", ""),
             delivery.get("PK", ""),
             delivery.get("PostcodeRaw", ""),
@@ -379,14 +508,20 @@ def export_driver_routes_to_csv(driver_id, deliveries):
             f"{drive_time + service_time} min"
         ])
     
+    csv_text.flush()
+    csv_text.detach()  # Keep csv_gzip open so closing it writes the gzip trailer
+    csv_gzip.close()   # Leaves csv_buffer open for the upload
+    csv_buffer.seek(0)
+    
     # Upload to S3
     timestamp = int(time.time())
     s3_key = f"driver_routes/{driver_id}_optimized_route_{timestamp}.csv"
-    s3.put_object(
-        Bucket=BUCKET_NAME, 
-        Key=s3_key, 
-        Body=csv_buffer.getvalue(),
-        ContentType='text/csv'
+    s3.upload_fileobj(
+        csv_buffer,
+        BUCKET_NAME,
+        s3_key,
+        ExtraArgs={'ContentType': 'text/csv', 'ContentEncoding': 'gzip'},
+        Config=CSV_TRANSFER_CONFIG
     )
     print(f"✅ Uploaded optimized route CSV for {driver_id} to S3: {s3_key}")
     return s3_key
@@ -395,83 +530,185 @@ def geocode_addresses_parallel(addresses, api_key):
     """Geocode multiple addresses in parallel to speed up processing"""
     address_to_coords = {}
     
-    def geocode_single(address):
-        coords = get_coordinates(address, api_key)
+    # Use the shared geocoding pool; handle results as they complete
+    futures = {
+        geocode_executor.submit(get_coordinates, address, api_key): address
+        for address in addresses
+    }
+    
+    for future in as_completed(futures):
+        address = futures[future]
+        coords = future.result()
         if coords:
-            return address, coords
-        return address, None
-    
-    # Use ThreadPoolExecutor for parallel processing
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        results = executor.map(
-            lambda addr: geocode_single(addr),
-            addresses
-        )
-        
-        for address, coords in results:
-            if coords:
-                address_to_coords[address] = coords
-            else:
-                print(f"⚠ Could not geocode address: {address}")
+            address_to_coords[address] = coords
+        else:
+            print(f"⚠ Could not geocode address: {address}")
     
     return address_to_coords
 
+def fetch_deliveries(processed_date):
+    """Query all deliveries for a given date from the ProcessedDate GSI, following pagination"""
+    deliveries = []
+    query_kwargs = {
+        "IndexName": PROCESSED_DATE_INDEX,
+        "KeyConditionExpression": Key("ProcessedDate").eq(processed_date)
+    }
+    
+    while True:
+        response = table.query(**query_kwargs)
+        deliveries.extend(response.get("Items", []))
+        
+        last_key = response.get("LastEvaluatedKey")
+        if not last_key:
+            return deliveries
+        query_kwargs["ExclusiveStartKey"] = last_key
+
+def process_driver(driver, stops, start_coords, address_index, coord_array, api_key):
+    """
+    Optimize, store and export the route for a single driver.
+    address_index maps a normalized address to its row in coord_array (lng, lat).
+    Returns a summary dict, or None if the route could not be optimized.
+    """
+    print(f"\n🚗 Optimizing route for {driver}: {len(stops)} stops")
+    
+    original_indices = []
+    coord_rows = []
+    postcode_mapping = []  # Store postcodes for each location
+    
+    # Prepare geocoded locations for this driver's stops
+    for index, stop in enumerate(stops):
+        postcode = stop.get("PostcodeRaw", "").strip()
+        row = address_index.get(normalize_address(postcode))
+        
+        if row is None:
+            print(f"⚠ Warning: No valid coordinates for postcode {postcode}. Skipping.")
+            continue
+            
+        original_indices.append(index)
+        coord_rows.append(row)
+        postcode_mapping.append(postcode)
+    
+    if not coord_rows:  # A single stop still gets a sequence and a CSV
+        print(f"⚠ No valid stops for {driver} to optimize")
+        return None
+    
+    # Gather this driver's coordinates as one contiguous (n, 2) array
+    location_coords = coord_array[coord_rows]
+    
+    # Optimize the route locally; the API is only used for the final legs' drive times
+    optimized_sequence = optimize_route(start_coords, location_coords)
+    
+    if not optimized_sequence:
+        print(f"⚠ Failed to optimize route for {driver}")
+        return None
+    
+    # Map optimized indices back to original stops
+    original_optimized_sequence = [original_indices[i] for i in optimized_sequence]
+    
+    # Print the human-readable route (one-way trip) in one call so drivers don't interleave
+    if DEBUG:
+        route_lines = [f"\n📍 Human-Readable Route for {driver} (one-way trip):", f"Start: {START_LOCATION}"]
+        for i, idx in enumerate(optimized_sequence):
+            route_lines.append(f"Stop {i+1}: {postcode_mapping[idx]}")
+        route_lines.append(f"Trip ends at final delivery: {postcode_mapping[optimized_sequence[-1]]}")
+        print("\n".join(route_lines))
+    
+    # Update the route sequence in DynamoDB
+    deliveries_updated = update_route_sequence(driver, stops, original_optimized_sequence)
+    
+    # Real drive times for the legs of the final route (one-way trip, no return to depot)
+    num_stops = len(original_optimized_sequence)
+    ordered_coords = np.vstack((start_coords, location_coords[optimized_sequence]))
+    leg_durations = calculate_leg_durations(ordered_coords, api_key)
+    if leg_durations is None:
+        print(f"⚠️ Could not fetch leg durations for {driver}. Using average timings.")
+    drive_minutes = estimate_drive_minutes(leg_durations, num_stops)
+    
+    # Export the route to CSV and upload to S3
+    s3_key = export_driver_routes_to_csv(driver, [stops[i] for i in original_optimized_sequence], drive_minutes)
+    
+    # Estimated route duration: driving plus time at each stop
+    # Note: No return to depot time since the trip ends at the last delivery
+    estimated_duration = sum(drive_minutes) + num_stops * SERVICE_MINUTES
+    
+    print(f"✅ Successfully optimized route for {driver}")
+    print(f"📊 Estimated route duration: {estimated_duration} minutes")
+    
+    return {
+        "deliveries_updated": deliveries_updated,
+        "estimated_duration": estimated_duration,
+        "route": {
+            "stops": len(original_optimized_sequence),
+            "csv_url": f"s3://{BUCKET_NAME}/{s3_key}"
+        }
+    }
+
 def lambda_handler(event, context):
     print("🚀 Delivery Route Optimizer - CIRCUIT MATCHING VERSION")
     start_time = time.time()
 
     api_key = os.environ.get('GOOGLE_MAPS_API_KEY', '')
     
-    # Scan DynamoDB for deliveries
+    # The manifest Lambda passes the ProcessedDate it stamped; fall back to today (UTC) for manual runs
+    processed_date = None
+    if isinstance(event, dict):
+        processed_date = event.get("processed_date")
+    processed_date = processed_date or time.strftime("%Y-%m-%d", time.gmtime())
+    
+    # Query DynamoDB for the day's deliveries
     try:
-        response = table.scan()
-        deliveries = response.get("Items", [])
+        deliveries = fetch_deliveries(processed_date)
     except Exception as e:
-        print(f"⚠ Failed to scan table {table.name}: {str(e)}")
-        return {'statusCode': 500, 'body': 'Failed to scan DynamoDB table'}
+        print(f"⚠ Failed to query table {table.name}: {str(e)}")
+        return {'statusCode': 500, 'body': 'Failed to query DynamoDB table'}
     
     if not deliveries:
-        print("⚠ No deliveries found in DynamoDB!")
+        print(f"⚠ No deliveries found in DynamoDB for {processed_date}!")
         return {'statusCode': 400, 'body': 'No deliveries found'}
 
-    print(f"📦 Found {len(deliveries)} total deliveries")
+    print(f"📦 Found {len(deliveries)} deliveries for {processed_date}")
     
     # Group deliveries by driver; collect unique addresses
     grouped_deliveries = {}
-    unique_addresses = {START_LOCATION}
+    unique_addresses = {normalize_address(START_LOCATION)}
     
     # Print all addresses/postcodes for debugging
-    print("\n📬 Delivery Addresses/Postcodes:")
+    if DEBUG:
+        print("\n📬 Delivery Addresses/Postcodes:\n" + "\n".join(
+            f"Postcode: {delivery.get('PostcodeRaw', '').strip()}" for delivery in deliveries
+        ))
     for delivery in deliveries:
         postcode = delivery.get("PostcodeRaw", "").strip()
-        print(f"Postcode: {postcode}")
         
         if not postcode:
             print(f"⚠ Warning: Delivery {delivery.get('PK', 'unknown')} has no postcode. Skipping.")
             continue
             
-        unique_addresses.add(postcode)  # Use postcode instead of full address
+        unique_addresses.add(normalize_address(postcode))  # Use postcode instead of full address
         
         driver_id = delivery.get("DriverID", "Unassigned")
-        if driver_id not in grouped_deliveries:
-            grouped_deliveries[driver_id] = []
-            
-        grouped_deliveries[driver_id].append(delivery)
+        grouped_deliveries.setdefault(driver_id, []).append(delivery)
 
     print(f"\n🗺️ Processing {len(unique_addresses)} unique addresses for {len(grouped_deliveries)} drivers")
 
     # Geocode all unique addresses in parallel
     address_to_coords = geocode_addresses_parallel(unique_addresses, api_key)
+    save_geocode_cache()
     
     if not address_to_coords:
         print("⚠ No valid coordinates fetched for addresses!")
         return {'statusCode': 400, 'body': 'Failed to fetch coordinates'}
 
+    # One coordinate array for all addresses; drivers look up rows by normalized address
+    address_index = {address: i for i, address in enumerate(address_to_coords)}
+    coord_array = np.array(list(address_to_coords.values()), dtype=np.float64)
+    
     # Get start coordinates from fixed start location
-    start_coords = address_to_coords.get(START_LOCATION)
-    if not start_coords:
+    start_row = address_index.get(normalize_address(START_LOCATION))
+    if start_row is None:
         print(f"⚠ Could not geocode start location: {START_LOCATION}")
         return {'statusCode': 400, 'body': 'Failed to geocode start location'}
+    start_coords = coord_array[start_row]
 
     # Store results for the response
     results = {
@@ -481,82 +718,29 @@ def lambda_handler(event, context):
         "route_durations": {}
     }
 
-    # Optimize routes for each driver
-    for driver, stops in grouped_deliveries.items():
-        print(f"\n🚗 Optimizing route for {driver}: {len(stops)} stops")
-        
-        locations = []
-        original_indices = []
-        postcode_mapping = []  # Store postcodes for each location
+    # Drivers are independent, so optimize them in parallel
+    with ThreadPoolExecutor(max_workers=DRIVER_MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(process_driver, driver, stops, start_coords, address_index, coord_array, api_key): driver
+            for driver, stops in grouped_deliveries.items()
+        }
         
-        # Prepare geocoded locations for this driver's stops
-        for index, stop in enumerate(stops):
-            postcode = stop.get("PostcodeRaw", "").strip()
-            coords = address_to_coords.get(postcode)
-            
-            if not coords:
-                print(f"⚠ Warning: No valid coordinates for postcode {postcode}. Skipping.")
+        for future in as_completed(futures):
+            driver = futures[future]
+            try:
+                driver_result = future.result()
+            except Exception as e:
+                print(f"⚠ Failed to optimize route for {driver}: {str(e)}")
                 continue
-                
-            locations.append({"lat": coords[1], "lon": coords[0]})
-            original_indices.append(index)
-            postcode_mapping.append(postcode)
-        
-        if len(locations) < 2:  # Need at least 2 locations to optimize
-            print(f"⚠ Not enough valid stops for {driver} to optimize")
-            continue
-        
-        # Extract just the coordinates for optimization
-        location_coords = [(loc["lon"], loc["lat"]) for loc in locations]
-        
-        # Optimize the route using enhanced optimization with Routes API
-        optimized_sequence = optimize_route_with_routes_api(start_coords, location_coords, api_key)
-        
-        if optimized_sequence:
-            # Map optimized indices back to original stops
-            original_optimized_sequence = [original_indices[i] for i in optimized_sequence]
-            
-            # Print the human-readable route (one-way trip)
-            print("\n📍 Human-Readable Route (one-way trip):")
-            print(f"Start: {START_LOCATION}")
-            for i, idx in enumerate(optimized_sequence):
-                postcode = postcode_mapping[idx]
-                print(f"Stop {i+1}: {postcode}")
-            print(f"Trip ends at final delivery: {postcode_mapping[optimized_sequence[-1]]}")
-            
-            # Update the route sequence in DynamoDB
-            deliveries_updated = update_route_sequence(driver, stops, original_optimized_sequence)
-            
-            # Export the route to CSV and upload to S3
-            s3_key = export_driver_routes_to_csv(driver, stops)
             
-            # Calculate estimated route duration for one-way trip (no return to depot)
-            num_stops = len(original_optimized_sequence)
-            avg_drive_time = 8  # minutes between stops
-            avg_service_time = 5  # minutes at each stop
-            depot_to_first_time = 20  # minutes from depot to first stop
-            
-            estimated_duration = (
-                depot_to_first_time +  # From depot to first stop
-                (num_stops - 1) * avg_drive_time +  # Between stops
-                num_stops * avg_service_time  # Time at each stop
-                # Note: No return to depot time since the trip ends at the last delivery
-            )
+            if not driver_result:
+                continue
             
             # Update results
             results["optimized_drivers"] += 1
-            results["total_deliveries_sequenced"] += deliveries_updated
-            results["driver_routes"][driver] = {
-                "stops": len(original_optimized_sequence),
-                "csv_url": f"s3://{BUCKET_NAME}/{s3_key}",
-                "route": [START_LOCATION] + [postcode_mapping[idx] for idx in optimized_sequence]
-            }
-            results["route_durations"][driver] = f"{estimated_duration} minutes"
-            
-            print(f"✅ Successfully optimized route for {driver}")
-            print(f"📊 Estimated route duration: {estimated_duration} minutes")
-        else:
-            print(f"⚠ Failed to optimize route for {driver}")
+            results["total_deliveries_sequenced"] += driver_result["deliveries_updated"]
+            results["driver_routes"][driver] = driver_result["route"]
+            results["route_durations"][driver] = f"{driver_result['estimated_duration']} minutes"
     
     # Calculate execution time
     execution_time = time.time() - start_time
@@ -564,7 +748,7 @@ def lambda_handler(event, context):
     
     return {
         'statusCode': 200, 
-        'body': json.dumps({
+        'body': json_dumps({
             'message': 'Route optimization completed',
             'results': results
         })
@@ -1,17 +1,52 @@
 import boto3
 import csv
+import io
+import gzip
 import re
-import uuid
+import hashlib
+import threading
+import queue
 import time
 import json
 import urllib.parse
-
-# AWS Services
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
+from operator import itemgetter
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# AWS Services (pooled keep-alive connections reused by warm invocations, adaptive retries)
+boto_config = Config(
+    max_pool_connections=64,
+    tcp_keepalive=True,
+    retries={'mode': 'adaptive', 'max_attempts': 10}
+)
+s3 = boto3.client('s3', config=boto_config)
+dynamodb = boto3.resource('dynamodb', config=boto_config)
 delivery_table = dynamodb.Table('DeliveryManagement')  # Stores delivery details
 driver_table = dynamodb.Table('DriverLocations')  # Stores driver ETA and locations
-lambda_client = boto3.client('lambda')
+lambda_client = boto3.client('lambda', config=boto_config)
+
+# Parsed delivery items stream through a bounded queue to several batch-writer threads
+DYNAMODB_WRITE_WORKERS = 8
+WRITE_QUEUE_SIZE = 200
+END_OF_ITEMS = object()  # Queued once per writer after the last row
+write_executor = ThreadPoolExecutor(max_workers=DYNAMODB_WRITE_WORKERS)  # Reused by warm invocations
+
+def write_deliveries(item_queue, abort):
+    """Drains delivery items from the queue into one batch writer until END_OF_ITEMS; returns the count written"""
+    stored_count = 0
+    item = None
+    try:
+        with delivery_table.batch_writer(overwrite_by_pkeys=['PK', 'SK']) as writer:
+            for item in iter(item_queue.get, END_OF_ITEMS):
+                if not abort.is_set():  # Another writer failed; just drain
+                    writer.put_item(Item=item)
+                    stored_count += 1
+    except Exception:
+        abort.set()  # Stops the parser and the other writers
+        while item is not END_OF_ITEMS:
+            item = item_queue.get()  # Keep draining so the parser never blocks on a full queue
+        raise
+    return stored_count
 
 # Driver Assignments by Postcode Prefix
 DRIVER_ASSIGNMENTS = {
@@ -20,22 +55,34 @@ DRIVER_ASSIGNMENTS = {
     "SE": "Driver 7", "SW": "Driver 8"
 }
 
+# Prefix lookups derived from DRIVER_ASSIGNMENTS; two-letter prefixes win over one-letter ones
+DRIVER_BY_TWO_LETTER_PREFIX = {prefix: driver for prefix, driver in DRIVER_ASSIGNMENTS.items() if len(prefix) == 2}
+DRIVER_BY_ONE_LETTER_PREFIX = {prefix: driver for prefix, driver in DRIVER_ASSIGNMENTS.items() if len(prefix) == 1}
+
+# Object tag set on manifests once their deliveries are stored
+PROCESSED_TAGGING = {'TagSet': [{'Key': 'processed', 'Value': 'true'}]}
+
+# Skipped or unassigned rows are summarized once per manifest, listing at most this many
+LOGGED_ROWS_LIMIT = 20
+
+# UK postcode, validated after spaces are stripped and the value upper-cased
+POSTCODE_RE = re.compile(r"[A-Z]{1,2}\d[A-Z\d]?\d[A-Z]{2}")
+
 def assign_driver(postcode):
-    """Assigns a driver based on the postcode prefix."""
-    postcode = postcode.replace(" ", "").upper()  # Normalize format
-    for prefix, driver in DRIVER_ASSIGNMENTS.items():
-        if postcode.startswith(prefix):
-            return driver
-    print(f"[WARNING] No driver assigned for postcode {postcode}")
-    return "Unassigned"
-
-def invoke_optimization_lambda():
-    """Triggers the optimization Lambda function after manifest processing."""
+    """Assigns a driver based on the prefix of a normalized (no spaces, upper-case) postcode."""
+    return DRIVER_BY_TWO_LETTER_PREFIX.get(postcode[:2]) or DRIVER_BY_ONE_LETTER_PREFIX.get(postcode[:1]) or "Unassigned"
+
+def delivery_id_for_row(manifest_id, row_index):
+    """Deterministic 128-bit hex ID, so reprocessing a manifest overwrites its rows instead of duplicating them."""
+    return hashlib.blake2b(f"{manifest_id}#{row_index}".encode(), digest_size=16).hexdigest()
+
+def invoke_optimization_lambda(processed_date):
+    """Triggers the optimization Lambda function for the deliveries stamped with processed_date."""
     try:
         response = lambda_client.invoke(
             FunctionName='OptimizeDriverRoutes',  # Ensure this is the correct Lambda function name
             InvocationType='Event',  # Asynchronous invocation
-            Payload=json.dumps({})
+            Payload=json.dumps({"processed_date": processed_date})  # Don't let the optimizer guess "today"
         )
         print("✅ Optimization Lambda invoked successfully:", response)
     except Exception as e:
@@ -45,8 +92,7 @@ def process_manifest(bucket, key):
     """Reads the incoming delivery manifest CSV and stores data in DynamoDB."""
     try:
         response = s3.get_object(Bucket=bucket, Key=key)
-        content = response['Body'].read().decode('utf-8-sig').splitlines()
-        csv_reader = csv.reader(content)
+        csv_reader = csv.reader(io.TextIOWrapper(response['Body'], encoding='utf-8-sig', newline=''))  # Decode while streaming
         header = next(csv_reader, None)
 
         print(f"ℹ️ [INFO] Detected Manifest Headers: {header}")
@@ -63,75 +109,100 @@ def process_manifest(bucket, key):
             print(f"⚠️ [WARNING] Missing headers in CSV: {missing_headers}")
             return
 
-        valid_entries = []
-        skipped_count = 0
-
-        for row_index, row in enumerate(csv_reader, 1):
-            try:
-                ride_type = row[header_map["Ride Type"]]
-                postcode = row[header_map["Postcode"]]
-                address_line1 = row[header_map["Address Line 1"]]
-                address_line2 = row[header_map["Address Line 2"]]
-                city = row[header_map["City"]]
-                address = f"{address_line1}, {address_line2}, {city}".strip(", ")
-                delivery_notes = row[header_map["Delivery Instructions"]]
-                customer_name = row[header_map["Customer Name"]]
-                customer_phone = row[header_map["Customer Phone Number"]]
-                box_number = row[header_map["Box Number"]]
-
-                # Validate postcode
-                if not re.match(r"^[A-Z]{1,2}\d[A-Z\d]? ?\d[A-Z]{2}$", postcode.replace(" ", "").upper()):
-                    print(f"⚠️ [WARNING] Invalid postcode at row {row_index}. Skipping.")
-                    skipped_count += 1
+        invalid_postcode_rows = []  # Skipped rows are reported once after parsing
+        failed_rows = []
+        unassigned_postcodes = []
+        created_at = int(time.time())
+        processed_date = time.strftime("%Y-%m-%d", time.gmtime(created_at))  # UTC processing date; partition key of the ProcessedDate GSI
+        manifest_id = f"{bucket}/{key}#{response.get('ETag', '')}"  # Same object version -> same delivery IDs
+
+        # Resolve column positions once; one C-level getter pulls all fields in required_headers order
+        get_fields = itemgetter(*[header_map[h] for h in required_headers])
+
+        abort = threading.Event()
+        item_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        queue_item = item_queue.put  # Bound once; called for every valid row
+        writers = [write_executor.submit(write_deliveries, item_queue, abort) for _ in range(DYNAMODB_WRITE_WORKERS)]
+
+        try:
+            for row_index, row in enumerate(csv_reader, 1):
+                if abort.is_set():
+                    break  # A write failed; the whole manifest is retried
+                try:
+                    (ride_type, postcode, address_line1, address_line2, city,
+                     delivery_notes, customer_name, customer_phone, box_number) = get_fields(row)
+                    address = ", ".join(part for part in (address_line1.strip(), address_line2.strip(), city.strip()) if part)
+
+                    # Validate postcode (normalized once; also used for driver assignment)
+                    normalized_postcode = postcode.replace(" ", "").upper()
+                    if not POSTCODE_RE.fullmatch(normalized_postcode):
+                        invalid_postcode_rows.append(row_index)
+                        continue
+
+                    driver_id = assign_driver(normalized_postcode)
+                    if driver_id == "Unassigned":
+                        unassigned_postcodes.append(postcode)
+                    delivery_id = f"DELIVERY#{delivery_id_for_row(manifest_id, row_index)}"
+                    sort_key = f"POSTCODE#{postcode}#{ride_type}#{box_number}"
+
+                    queue_item({
+                        'PK': delivery_id,
+                        'SK': sort_key,
+                        'RideType': ride_type,
+                        'DriverID': driver_id,
+                        'Address': address,
+                        'DeliveryNotes': delivery_notes,
+                        'CustomerName': customer_name,
+                        'CustomerPhone': customer_phone,
+                        'BoxNumber': box_number,
+                        'PostcodeRaw': postcode,
+                        'ProcessedDate': processed_date,
+                        'CreatedAt': created_at
+                    })
+
+                except Exception as e:
+                    failed_rows.append(f"{row_index} ({str(e)[:200]})")
                     continue
-
-                driver_id = assign_driver(postcode)
-                delivery_id = f"DELIVERY#{uuid.uuid4().hex}"
-                sort_key = f"POSTCODE#{postcode}#{ride_type}#{box_number}"
-
-                valid_entries.append({
-                    'PK': delivery_id,
-                    'SK': sort_key,
-                    'RideType': ride_type,
-                    'DriverID': driver_id,
-                    'Address': address,
-                    'DeliveryNotes': delivery_notes,
-                    'CustomerName': customer_name,
-                    'CustomerPhone': customer_phone,
-                    'BoxNumber': box_number,
-                    'PostcodeRaw': postcode,
-                    'CreatedAt': int(time.time())
-                })
-
-            except Exception as e:
-                print(f"❌ [ERROR] Error processing row {row_index}: {str(e)}")
-                skipped_count += 1
-                continue
-
-        # Store in DynamoDB
-        with delivery_table.batch_writer() as writer:
-            for entry in valid_entries:
-                writer.put_item(Item=entry)
-
-        print(f"✅ [COMPLETE] Processed {len(valid_entries)} entries. Skipped: {skipped_count}")
-
-        # Move file to processed folder
-        processed_key = key.replace('incoming/', 'processed/')
-        s3.copy_object(Bucket=bucket, Key=processed_key, CopySource={'Bucket': bucket, 'Key': key})
-        s3.delete_object(Bucket=bucket, Key=key)
-
-        # Trigger Optimization Lambda
-        invoke_optimization_lambda()
+        finally:
+            for _ in writers:
+                item_queue.put(END_OF_ITEMS)
+            wait(writers)  # No writer outlives the invocation
+
+        stored_count = sum(writer.result() for writer in writers)  # Re-raises the first write error
+
+        if invalid_postcode_rows:
+            print(f"⚠️ [WARNING] Invalid postcode at {len(invalid_postcode_rows)} rows. Skipped. "
+                  f"First rows: {invalid_postcode_rows[:LOGGED_ROWS_LIMIT]}")
+        if failed_rows:
+            print(f"❌ [ERROR] Error processing {len(failed_rows)} rows. "
+                  f"First rows: {', '.join(failed_rows[:LOGGED_ROWS_LIMIT])}")
+        if unassigned_postcodes:
+            print(f"⚠️ [WARNING] No driver assigned for {len(unassigned_postcodes)} deliveries. "
+                  f"First postcodes: {unassigned_postcodes[:LOGGED_ROWS_LIMIT]}")
+
+        skipped_count = len(invalid_postcode_rows) + len(failed_rows)
+        print(f"✅ [COMPLETE] Processed {stored_count} entries. Skipped: {skipped_count}")
+
+        # Mark the file as processed in place (archived by a bucket lifecycle rule),
+        # overlapping the tagging round-trip with the Optimization Lambda trigger
+        tagging = write_executor.submit(s3.put_object_tagging, Bucket=bucket, Key=key, Tagging=PROCESSED_TAGGING)
+        invoke_optimization_lambda(processed_date)
+        tagging.result()
 
     except Exception as e:
+        # Raised out of lambda_handler so Lambda retries the S3 event; delivery IDs are
+        # deterministic, so the retry overwrites whatever was already stored
         print(f"❌ [ERROR] Failed to process delivery manifest: {str(e)}")
+        raise
 
 def update_driver_eta_from_csv(bucket, key):
     """Reads optimized routes CSV and updates DriverLocations in DynamoDB with ETA."""
     try:
         response = s3.get_object(Bucket=bucket, Key=key)
-        content = response['Body'].read().decode('utf-8-sig').splitlines()
-        csv_reader = csv.reader(content)
+        body = response['Body']
+        if response.get('ContentEncoding') == 'gzip':  # Route CSVs are uploaded gzip-compressed
+            body = gzip.GzipFile(fileobj=body, mode='rb')
+        csv_reader = csv.reader(io.TextIOWrapper(body, encoding='utf-8-sig', newline=''))  # Decode while streaming
         header = next(csv_reader, None)
 
         print(f"ℹ️ [INFO] Optimized Routes CSV Headers: {header}")
@@ -144,22 +215,15 @@ def update_driver_eta_from_csv(bucket, key):
             print(f"⚠️ [WARNING] Missing headers in CSV: {missing_headers}")
             return
 
-        for row in csv_reader:
-            driver_id = row[header_map["DriverID"]]
-            postcode = row[header_map["Postcode"]]
-            eta = row[header_map["EstimatedArrivalTime"]]
-            duration = row[header_map["EstimatedDuration"]]
-
-            # Store data in DriverLocations table
-            driver_table.put_item(
-                Item={
-                    'DriverID': driver_id,
-                    'Postcode': postcode,
-                    'EstimatedArrivalTime': eta,
-                    'EstimatedDuration': duration
-                }
-            )
-            print(f"✅ [UPDATED] Stored ETA for driver {driver_id} in DynamoDB.")
+        # Store data in DriverLocations table (batched, 25 items per request)
+        stored_count = 0
+        get_fields = itemgetter(*[header_map[h] for h in required_headers])
+        with driver_table.batch_writer(overwrite_by_pkeys=['DriverID', 'Postcode']) as writer:
+            for row in csv_reader:
+                writer.put_item(Item=dict(zip(required_headers, get_fields(row))))
+                stored_count += 1
+
+        print(f"✅ [UPDATED] Stored {stored_count} ETAs in DynamoDB.")
 
     except Exception as e:
         print(f"❌ [ERROR] Failed to process Optimized Routes CSV: {str(e)}")
@@ -170,7 +234,7 @@ def lambda_handler(event, context):
     try:
         record = event['Records'][0]
         bucket = record['s3']['bucket']['name']
-        key = record['s3']['object']['key']
+        key = urllib.parse.unquote_plus(record['s3']['object']['key'])  # Event keys are URL-encoded
     except KeyError:
         print("❌ [ERROR] Missing 'Records' in event.")
         return {'statusCode': 400, 'body': 'Invalid event structure'}
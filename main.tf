@@ -12,6 +12,29 @@ resource "aws_s3_bucket" "delivery_manifest" {
   }
 }
 
+# 🚀 Bucket lifecycle: archive processed manifests
+resource "aws_s3_bucket_lifecycle_configuration" "delivery_manifest_cache" {
+  bucket = aws_s3_bucket.delivery_manifest.id
+
+  # Manifests tagged processed=true by ProcessDeliveryCSV stay under incoming/
+  rule {
+    id     = "archive-processed-manifests"
+    status = "Enabled"
+
+    filter {
+      tag {
+        key   = "processed"
+        value = "true"
+      }
+    }
+
+    transition {
+      days          = 30
+      storage_class = "STANDARD_IA"
+    }
+  }
+}
+
 # 🚀 DynamoDB Table for Deliveries
 resource "aws_dynamodb_table" "delivery_management" {
   name         = "DeliveryManagement"
@@ -29,6 +52,24 @@ resource "aws_dynamodb_table" "delivery_management" {
     type = "S"
   }
 
+  attribute {
+    name = "ProcessedDate"
+    type = "S"
+  }
+
+  attribute {
+    name = "DriverID"
+    type = "S"
+  }
+
+  # Lets the optimizer query one day's deliveries instead of scanning the table
+  global_secondary_index {
+    name            = "ProcessedDate-DriverID-index"
+    hash_key        = "ProcessedDate"
+    range_key       = "DriverID"
+    projection_type = "ALL"
+  }
+
   tags = {
     Name        = "DeliveryManagementTable"
     Environment = "Dev"
@@ -84,7 +125,7 @@ resource "aws_iam_policy" "lambda_policy" {
     Statement = [
       {
         Effect = "Allow"
-        Action = ["s3:GetObject", "s3:PutObject", "s3:ListBucket"]
+        Action = ["s3:GetObject", "s3:PutObject", "s3:PutObjectTagging", "s3:ListBucket"]
         Resource = [
           "arn:aws:s3:::delivery-manifest-bucket",
           "arn:aws:s3:::delivery-manifest-bucket/*"
@@ -92,9 +133,10 @@ resource "aws_iam_policy" "lambda_policy" {
       },
       {
         Effect = "Allow"
-        Action = ["dynamodb:PutItem", "dynamodb:Scan", "dynamodb:Query"]
+        Action = ["dynamodb:PutItem", "dynamodb:UpdateItem", "dynamodb:BatchWriteItem", "dynamodb:Scan", "dynamodb:Query", "dynamodb:DescribeTable"]
         Resource = [
           aws_dynamodb_table.delivery_management.arn,
+          "${aws_dynamodb_table.delivery_management.arn}/index/*",
           aws_dynamodb_table.driver_locations.arn
         ]
       }
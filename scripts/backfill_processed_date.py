@@ -0,0 +1,62 @@
+"""One-off backfill: stamp ProcessedDate on deliveries written before the ProcessedDate GSI existed.
+
+ProcessedDate is the UTC date of CreatedAt, exactly as ProcessDeliveryCSV stamps it.
+Items without CreatedAt are reported and left alone. Safe to re-run.
+
+Usage: python scripts/backfill_processed_date.py [--dry-run]
+"""
+import sys
+import time
+import boto3
+from boto3.dynamodb.conditions import Attr
+from botocore.config import Config
+
+TABLE_NAME = 'DeliveryManagement'
+
+boto_config = Config(retries={'mode': 'adaptive', 'max_attempts': 10})
+table = boto3.resource('dynamodb', config=boto_config).Table(TABLE_NAME)
+
+
+def missing_processed_date():
+    """Yields PK, SK and CreatedAt of every item without ProcessedDate, following pagination."""
+    scan_kwargs = {
+        "FilterExpression": Attr('ProcessedDate').not_exists(),
+        "ProjectionExpression": "PK, SK, CreatedAt"
+    }
+    while True:
+        response = table.scan(**scan_kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def main(dry_run=False):
+    updated = 0
+    skipped = 0
+    for item in missing_processed_date():
+        created_at = item.get('CreatedAt')
+        if created_at is None:
+            print(f"⚠️ [WARNING] No CreatedAt on {item['PK']} / {item['SK']}. Skipped.")
+            skipped += 1
+            continue
+
+        processed_date = time.strftime("%Y-%m-%d", time.gmtime(int(created_at)))
+        if not dry_run:
+            try:
+                table.update_item(
+                    Key={'PK': item['PK'], 'SK': item['SK']},
+                    UpdateExpression="SET ProcessedDate = :d",
+                    ConditionExpression=Attr('ProcessedDate').not_exists(),  # Never overwrite a stamped date
+                    ExpressionAttributeValues={':d': processed_date}
+                )
+            except table.meta.client.exceptions.ConditionalCheckFailedException:
+                continue  # Stamped since the scan
+        updated += 1
+
+    action = "Would backfill" if dry_run else "Backfilled"
+    print(f"✅ {action} ProcessedDate on {updated} items; {skipped} skipped without CreatedAt")
+
+
+if __name__ == '__main__':
+    main(dry_run='--dry-run' in sys.argv[1:])